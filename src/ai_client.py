@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import AsyncIterator, List, Sequence
+import time
+from typing import AsyncIterator, Dict, List, Sequence
 
-from openai import AsyncOpenAI, BadRequestError, RateLimitError
+import orjson
+from openai import AsyncOpenAI, AsyncStream, BadRequestError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 from tenacity import (
     AsyncRetrying,
     retry_if_exception_type,
@@ -11,7 +15,12 @@ from tenacity import (
     wait_random_exponential,
 )
 
-from .config import Settings
+from .config import (
+    API_KEY_COOLDOWN,
+    STREAM_BATCH_CHARS,
+    STREAM_BATCH_INTERVAL,
+    Settings,
+)
 
 
 CHAT_ROLES = {"user", "assistant", "system"}
@@ -23,8 +32,10 @@ class AIClient:
         self._settings = settings
         keys = list(settings.api_keys or (settings.api_key,))
         self._api_keys: List[str] = keys or [settings.api_key]
+        self._clients = [self._build_client(key) for key in self._api_keys]
+        self._key_cooldowns: Dict[int, float] = {}
         self._current_key_idx = 0
-        self._client = self._build_client(self._api_keys[self._current_key_idx])
+        self._client = self._clients[self._current_key_idx]
 
     def _build_client(self, api_key: str) -> AsyncOpenAI:
         return AsyncOpenAI(
@@ -35,9 +46,20 @@ class AIClient:
     def _rotate_key(self) -> bool:
         if len(self._api_keys) <= 1:
             return False
-        self._current_key_idx = (self._current_key_idx + 1) % len(self._api_keys)
-        new_key = self._api_keys[self._current_key_idx]
-        self._client = self._build_client(new_key)
+        now = time.monotonic()
+        self._key_cooldowns[self._current_key_idx] = now + API_KEY_COOLDOWN
+        candidates = [
+            (self._current_key_idx + offset) % len(self._api_keys)
+            for offset in range(1, len(self._api_keys))
+        ]
+        next_idx = next(
+            (idx for idx in candidates if self._key_cooldowns.get(idx, 0.0) <= now),
+            None,
+        )
+        if next_idx is None:
+            next_idx = min(candidates, key=lambda idx: self._key_cooldowns[idx])
+        self._current_key_idx = next_idx
+        self._client = self._clients[next_idx]
         logger.warning(
             "Переключаюсь на следующий API ключ (index=%s)", self._current_key_idx
         )
@@ -56,6 +78,13 @@ class AIClient:
         return False
 
     def _normalize_messages(self, messages: Sequence[dict]) -> List[dict]:
+        if all(
+            message.get("role") in CHAT_ROLES
+            and isinstance(message.get("content"), (str, list))
+            for message in messages
+        ):
+            return list(messages)
+
         normalized: List[dict] = []
         for message in messages:
             role = message.get("role")
@@ -71,6 +100,37 @@ class AIClient:
                 normalized.append({"role": role, "content": str(content)})
         return normalized
 
+    async def _create_stream(
+        self, payload: List[dict], temperature: float, max_tokens: int
+    ) -> AsyncStream[ChatCompletionChunk]:
+        if any(isinstance(message["content"], list) for message in payload):
+            # Multimodal payloads carry base64 media; serialize them with orjson
+            # instead of letting the SDK walk and json.dumps the whole body.
+            body = orjson.dumps(
+                {
+                    "model": self._settings.model_name,
+                    "messages": payload,
+                    "temperature": temperature,
+                    "max_completion_tokens": max_tokens,
+                    "stream": True,
+                }
+            )
+            return await self._client.post(
+                "/chat/completions",
+                content=body,
+                options={"headers": {"Content-Type": "application/json"}},
+                cast_to=ChatCompletion,
+                stream=True,
+                stream_cls=AsyncStream[ChatCompletionChunk],
+            )
+        return await self._client.chat.completions.create(
+            model=self._settings.model_name,
+            messages=payload,
+            temperature=temperature,
+            max_completion_tokens=max_tokens,
+            stream=True,
+        )
+
     async def generate_reply(
         self,
         messages: Sequence[dict],
@@ -103,17 +163,17 @@ class AIClient:
                     return message.content or ""
                 except Exception as exc:
                     if self._should_rotate_key(exc):
-                        logger.debug(
-                            "Ошибка rate limit. Текущий ключ: %s, переключений: %s/%s, начальный: %s",
-                            self._current_key_idx,
-                            keys_rotated,
-                            len(self._api_keys),
-                            initial_key_idx,
-                        )
                         if keys_rotated < len(self._api_keys):
                             if self._rotate_key():
                                 keys_rotated += 1
-                                logger.info("Ключ переключён после ошибки: %s", exc)
+                                logger.info(
+                                    "Ключ переключён после ошибки rate limit "
+                                    "(переключений: %s/%s, начальный: %s): %s",
+                                    keys_rotated,
+                                    len(self._api_keys),
+                                    initial_key_idx,
+                                    exc,
+                                )
                                 if self._current_key_idx == initial_key_idx and keys_rotated > 0:
                                     logger.warning(
                                         "Прошёл полный круг по всем ключам (%s), но ошибка сохраняется",
@@ -151,34 +211,42 @@ class AIClient:
         ):
             with attempt:
                 try:
-                    stream = await self._client.chat.completions.create(
-                        model=self._settings.model_name,
-                        messages=payload,
-                        temperature=temperature,
-                        max_completion_tokens=max_tokens,
-                        stream=True,
-                    )
+                    stream = await self._create_stream(payload, temperature, max_tokens)
+                    loop = asyncio.get_running_loop()
+                    buffer: List[str] = []
+                    buffered_chars = 0
+                    flushed_at = float("-inf")
                     async for chunk in stream:
                         if chunk.choices and len(chunk.choices) > 0:
                             delta = chunk.choices[0].delta
                             if delta and hasattr(delta, 'content') and delta.content:
-                                content = delta.content
-                                if content:
-                                    yield content
+                                buffer.append(delta.content)
+                                buffered_chars += len(delta.content)
+                                now = loop.time()
+                                if (
+                                    buffered_chars >= STREAM_BATCH_CHARS
+                                    or now - flushed_at >= STREAM_BATCH_INTERVAL
+                                ):
+                                    yield "".join(buffer)
+                                    buffer.clear()
+                                    buffered_chars = 0
+                                    flushed_at = now
+                    if buffer:
+                        yield "".join(buffer)
                     return
                 except Exception as exc:
                     if self._should_rotate_key(exc):
-                        logger.debug(
-                            "Ошибка rate limit. Текущий ключ: %s, переключений: %s/%s, начальный: %s",
-                            self._current_key_idx,
-                            keys_rotated,
-                            len(self._api_keys),
-                            initial_key_idx,
-                        )
                         if keys_rotated < len(self._api_keys):
                             if self._rotate_key():
                                 keys_rotated += 1
-                                logger.info("Ключ переключён после ошибки: %s", exc)
+                                logger.info(
+                                    "Ключ переключён после ошибки rate limit "
+                                    "(переключений: %s/%s, начальный: %s): %s",
+                                    keys_rotated,
+                                    len(self._api_keys),
+                                    initial_key_idx,
+                                    exc,
+                                )
                                 if self._current_key_idx == initial_key_idx and keys_rotated > 0:
                                     logger.warning(
                                         "Прошёл полный круг по всем ключам (%s), но ошибка сохраняется",
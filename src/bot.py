@@ -1,13 +1,17 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
 import logging
-import time
+import queue
+import signal
+from dataclasses import dataclass, field
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from loguru import logger
-from telegram import BotCommand, Update
+from telegram import BotCommand, Message, MessageEntity, Update
 from telegram.constants import ParseMode
-from telegram.error import BadRequest, RetryAfter, TimedOut
+from telegram.error import BadRequest, RetryAfter, TelegramError, TimedOut
 from telegram.ext import (
     AIORateLimiter,
     Application,
@@ -21,32 +25,73 @@ from telegram.ext import (
 from .ai_client import AIClient
 from .config import (
     CHUNK_BODY_LIMIT,
+    DIALOGUE_FLUSH_INTERVAL,
     MAX_MESSAGE_LENGTH,
     Settings,
+    STREAM_PREVIEW_LENGTH,
     UPDATE_INTERVAL,
 )
-from .filters import contains_stop_words
+from .classifiers import CONFERENCE, STOP, WEB_SEARCH, classify
 from .formatters import (
     CODE_BLOCK_RE,
     format_message,
+    prepare_for_edit,
     remove_markdown_stars,
     split_formatted_text,
+    strip_code_blocks,
 )
 from .handlers import (
     get_bot_info_text,
+    get_conference_context,
     handle_about,
     handle_help,
     handle_menu_button,
     handle_reset,
     handle_start,
-    is_conference_question,
-    load_conference_info,
     SYSTEM_PROMPT,
 )
 from .media_processor import get_audio_base64, get_photo_base64
 from .state import ContextStore
 from .storage import DialogueStorage
-from .web_search import build_search_query, needs_web_search, search_web
+from .web_search import build_search_query, close_search_client, search_web
+
+
+class _IncomingMessageFilter(filters.MessageFilter):
+    __slots__ = ()
+
+    def filter(self, message: Message) -> bool:
+        if message.text:
+            entities = message.entities
+            return not (
+                entities
+                and entities[0].type == MessageEntity.BOT_COMMAND
+                and entities[0].offset == 0
+            )
+        return bool(message.photo or message.audio or message.voice or message.video_note)
+
+
+_INCOMING_MESSAGES = _IncomingMessageFilter(name="incoming_messages")
+
+
+@dataclass
+class _StreamPreview:
+    parts: list[str] = field(default_factory=list)
+    dirty: bool = False
+
+    def append(self, chunk: str) -> None:
+        self.parts.append(chunk)
+        self.dirty = True
+
+    @property
+    def text(self) -> str:
+        if len(self.parts) > 1:
+            self.parts[:] = ["".join(self.parts)]
+        return self.parts[0] if self.parts else ""
+
+
+@dataclass
+class _CodeBlockScan:
+    last_scanned_end: int = 0
 
 
 class TelegramAIAgent:
@@ -57,6 +102,9 @@ class TelegramAIAgent:
         self._storage = DialogueStorage(db_path)
         self._context_store = ContextStore(storage=self._storage)
         self._bot_info: dict | None = None
+        self._system_messages: list[dict] = []
+        self._system_messages_bot_id: int | None = None
+        self._flush_task: asyncio.Task | None = None
 
     async def build_application(self) -> Application:
         application = (
@@ -72,11 +120,7 @@ class TelegramAIAgent:
         application.add_handler(CommandHandler("reset", self.on_reset))
         application.add_handler(CallbackQueryHandler(self.on_menu_button))
         application.add_handler(
-            MessageHandler(
-                (filters.TEXT | filters.PHOTO | filters.AUDIO | filters.VOICE | filters.VIDEO_NOTE)
-                & (~filters.COMMAND),
-                self.on_message,
-            )
+            MessageHandler(_INCOMING_MESSAGES, self.on_message)
         )
 
         commands = [
@@ -89,6 +133,21 @@ class TelegramAIAgent:
 
         return application
 
+    def start(self) -> None:
+        self._flush_task = asyncio.create_task(
+            self._context_store.run_flush_loop(DIALOGUE_FLUSH_INTERVAL)
+        )
+
+    async def stop(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._flush_task
+            self._flush_task = None
+        await self._context_store.flush()
+        self._storage.close()
+        await close_search_client()
+
     async def _post_init(self, application: Application) -> None:
         bot_me = await application.bot.get_me()
         self._bot_info = {
@@ -145,160 +204,152 @@ class TelegramAIAgent:
         if text:
             content_parts.append({"type": "text", "text": text})
 
-        if message.photo:
-            photo_b64 = await get_photo_base64(message.photo)
-            if photo_b64:
-                content_parts.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{photo_b64}"},
-                    }
-                )
+        photo_b64, audio_b64, voice_b64 = await asyncio.gather(
+            get_photo_base64(message.photo),
+            get_audio_base64(message.audio),
+            get_audio_base64(message.voice),
+        )
 
-        if message.audio:
-            audio_b64 = await get_audio_base64(message.audio)
-            if audio_b64:
-                mime_type = message.audio.mime_type or "audio/mpeg"
-                content_parts.append(
-                    {
-                        "type": "input_audio",
-                        "input_audio": {"data": audio_b64, "format": mime_type},
-                    }
-                )
+        if photo_b64:
+            content_parts.append(
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{photo_b64}"},
+                }
+            )
 
-        if message.voice:
-            audio_b64 = await get_audio_base64(message.voice)
-            if audio_b64:
-                content_parts.append(
-                    {
-                        "type": "input_audio",
-                        "input_audio": {"data": audio_b64, "format": "audio/ogg"},
-                    }
-                )
+        if audio_b64:
+            mime_type = message.audio.mime_type or "audio/mpeg"
+            content_parts.append(
+                {
+                    "type": "input_audio",
+                    "input_audio": {"data": audio_b64, "format": mime_type},
+                }
+            )
+
+        if voice_b64:
+            content_parts.append(
+                {
+                    "type": "input_audio",
+                    "input_audio": {"data": voice_b64, "format": "audio/ogg"},
+                }
+            )
 
         return content_parts
 
     def _build_system_messages(self) -> list[dict]:
-        system_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        bot_id = self._bot_info.get("id") if self._bot_info else None
+        if not self._system_messages or bot_id != self._system_messages_bot_id:
+            system_messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+            bot_info_text = get_bot_info_text(self._bot_info)
+            if bot_info_text:
+                system_messages.append({"role": "system", "content": bot_info_text})
 
-        bot_info_text = get_bot_info_text(self._bot_info)
-        if bot_info_text:
-            system_messages.append({"role": "system", "content": bot_info_text})
+            self._system_messages = system_messages
+            self._system_messages_bot_id = bot_id
 
-        return system_messages
+        return list(self._system_messages)
 
-    async def _add_conference_context(
+    def _add_conference_context(self, history: list[dict]) -> None:
+        conference_context = get_conference_context()
+        if conference_context:
+            history.append({"role": "system", "content": conference_context})
+            logger.debug("Добавлена информация о конференции в контекст")
+
+    async def _add_web_search_context(
         self, text: str, history: list[dict]
     ) -> None:
-        if text and is_conference_question(text):
-            conference_info = load_conference_info()
-            if conference_info:
+        logger.debug("Определена необходимость веб-поиска для текста: %s", text[:100])
+        try:
+            search_query = build_search_query(text)
+            search_result = await search_web(search_query)
+            if search_result:
                 history.append(
                     {
                         "role": "system",
-                        "content": f"Полная информация о конференции ТАТАР САН 2025:\n\n{conference_info}",
+                        "content": (
+                            f"Результаты поиска в интернете:\n\n{search_result}\n\n"
+                            "Используй эту информацию для ответа на вопрос пользователя. "
+                            "Если в результатах поиска есть актуальная дата, число или год, "
+                            "обязательно используй эту информацию."
+                        ),
                     }
                 )
-                logger.debug("Добавлена информация о конференции в контекст")
-
-    async def _add_web_search_context(
-        self, text: str, history: list[dict]
-    ) -> None:
-        if text and needs_web_search(text):
-            logger.debug("Определена необходимость веб-поиска для текста: %s", text[:100])
-            try:
-                search_query = build_search_query(text)
-                search_result = await search_web(search_query)
-                if search_result:
-                    history.append(
-                        {
-                            "role": "system",
-                            "content": (
-                                f"Результаты поиска в интернете:\n\n{search_result}\n\n"
-                                "Используй эту информацию для ответа на вопрос пользователя. "
-                                "Если в результатах поиска есть актуальная дата, число или год, "
-                                "обязательно используй эту информацию."
-                            ),
-                        }
-                    )
-                    logger.info(
-                        "Добавлены результаты поиска в контекст (длина: %d символов)",
-                        len(search_result),
-                    )
-                else:
-                    logger.warning(
-                        "Поиск выполнен, но результат пустой для запроса: %s", text[:100]
-                    )
-            except Exception as exc:
-                logger.warning("Не удалось выполнить поиск через Exa: %s", exc)
+                logger.info(
+                    "Добавлены результаты поиска в контекст (длина: %d символов)",
+                    len(search_result),
+                )
+            else:
+                logger.warning(
+                    "Поиск выполнен, но результат пустой для запроса: %s", text[:100]
+                )
+        except Exception as exc:
+            logger.warning("Не удалось выполнить поиск через Exa: %s", exc)
 
     async def _send_code_blocks(
-        self, accumulated_text: str, message, sent_code_blocks: set
+        self, accumulated_text: str, message, scan: _CodeBlockScan
     ) -> None:
-        for match in CODE_BLOCK_RE.finditer(accumulated_text):
-            code_block_full = match.group(0)
-            if code_block_full not in sent_code_blocks:
-                sent_code_blocks.add(code_block_full)
-                language = (match.group(1) or "").strip()
-                code = match.group(2).strip("\n")
-                if code:
-                    lang_prefix = f"{language}\n" if language else ""
-                    code_message = f"```{lang_prefix}{code}\n```"
-                    try:
-                        await message.reply_text(
-                            code_message, parse_mode=ParseMode.MARKDOWN_V2
-                        )
-                    except BadRequest:
-                        try:
-                            await message.reply_text(code_message, parse_mode=None)
-                        except (BadRequest, RetryAfter, TimedOut):
-                            pass
-
-    async def _update_status_message(
-        self,
-        status_message,
-        accumulated_text: str,
-        last_update_time: float,
-        chunk_count: int,
-    ) -> tuple[bool, float]:
-        current_time = time.time()
-        should_update = chunk_count == 1 or (
-            current_time - last_update_time >= UPDATE_INTERVAL
-            and accumulated_text.strip()
-        )
-
-        if should_update:
-            text_without_code = accumulated_text
-            for match in CODE_BLOCK_RE.finditer(accumulated_text):
-                text_without_code = text_without_code.replace(match.group(0), "")
-
-            safe_text = remove_markdown_stars(text_without_code)
-            if safe_text.strip():
-                formatted_text = format_message(safe_text)
-                if not formatted_text.strip() or formatted_text.strip() == "-":
-                    return False, last_update_time
+        # The reply only grows, so a closed block keeps its span and is never
+        # rescanned once last_scanned_end has moved past it.
+        for match in CODE_BLOCK_RE.finditer(accumulated_text, scan.last_scanned_end):
+            scan.last_scanned_end = match.end()
+            language = (match.group(1) or "").strip()
+            code = match.group(2).strip("\n")
+            if code:
+                lang_prefix = f"{language}\n" if language else ""
+                code_message = f"```{lang_prefix}{code}\n```"
                 try:
-                    await self._safe_edit(
-                        status_message, formatted_text, parse_mode=ParseMode.MARKDOWN_V2
+                    await message.reply_text(
+                        code_message, parse_mode=ParseMode.MARKDOWN_V2
                     )
-                    return False, current_time
-                except RetryAfter as e:
-                    await asyncio.sleep(e.retry_after)
-                    return True, current_time
-                except TimedOut:
-                    return True, current_time
                 except BadRequest:
                     try:
-                        await self._safe_edit(
-                            status_message,
-                            safe_text[:MAX_MESSAGE_LENGTH],
-                            parse_mode=None,
-                        )
-                        return False, current_time
+                        await message.reply_text(code_message, parse_mode=None)
                     except (BadRequest, RetryAfter, TimedOut):
-                        return True, current_time
+                        pass
 
-        return False, last_update_time
+    async def _run_status_editor(self, status_message, preview: _StreamPreview) -> None:
+        loop = asyncio.get_running_loop()
+        tick_started = loop.time()
+        last_sent_text = ""
+        while True:
+            await asyncio.sleep(max(0.0, tick_started + UPDATE_INTERVAL - loop.time()))
+            tick_started = loop.time()
+            if not preview.dirty:
+                continue
+            preview.dirty = False
+
+            text_without_code = strip_code_blocks(preview.text)
+            preview_text = text_without_code[-STREAM_PREVIEW_LENGTH:]
+            if not preview_text.strip():
+                continue
+            formatted_text = prepare_for_edit(preview_text)
+            if (
+                not formatted_text.strip()
+                or formatted_text.strip() == "-"
+                or formatted_text == last_sent_text
+            ):
+                continue
+            try:
+                await self._safe_edit(
+                    status_message, formatted_text, parse_mode=ParseMode.MARKDOWN_V2
+                )
+                last_sent_text = formatted_text
+            except (RetryAfter, TimedOut):
+                preview.dirty = True
+            except BadRequest:
+                try:
+                    await self._safe_edit(
+                        status_message,
+                        remove_markdown_stars(preview_text)[:MAX_MESSAGE_LENGTH],
+                        parse_mode=None,
+                    )
+                except TelegramError:
+                    preview.dirty = True
+            except TelegramError as exc:
+                logger.warning("Не удалось обновить превью ответа: {}", exc)
+                preview.dirty = True
 
     async def on_message(
         self, update: Update, context: ContextTypes.DEFAULT_TYPE
@@ -309,7 +360,8 @@ class TelegramAIAgent:
             return
 
         text = message.text or message.caption or ""
-        if text and contains_stop_words(text):
+        text_flags = classify(text) if text else 0
+        if text_flags & STOP:
             await message.reply_text("Пожалуйста, без нецензурных слов 🙏")
             return
 
@@ -319,72 +371,65 @@ class TelegramAIAgent:
 
         if len(content_parts) == 1 and content_parts[0].get("type") == "text":
             user_content = content_parts[0]["text"]
-        elif len(content_parts) > 1:
-            user_content = content_parts
         else:
-            user_content = content_parts[0]
+            user_content = content_parts
 
-        self._context_store.append(user.id, "user", user_content)
+        await self._context_store.append(user.id, "user", user_content)
 
         await self._ensure_bot_info(context)
 
         history = self._build_system_messages()
 
-        await self._add_conference_context(text, history)
-        await self._add_web_search_context(text, history)
+        if text_flags & CONFERENCE:
+            self._add_conference_context(history)
+        if text_flags & WEB_SEARCH:
+            await self._add_web_search_context(text, history)
 
-        history.extend(self._context_store.get(user.id).export())
+        dialogue = await self._context_store.get(user.id)
+        history.extend(dialogue.export())
 
         status_message = await message.reply_text("🤖 Думаю над ответом...")
 
         try:
-            accumulated_text = ""
-            last_update_time = 0.0
-            chunk_count = 0
-            pending_update = False
-            sent_code_blocks: set[str] = set()
-
-            async for chunk in self._ai_client.generate_reply_stream(history):
-                if not chunk:
-                    continue
-
-                accumulated_text += chunk
-                chunk_count += 1
+            preview = _StreamPreview()
+            code_block_scan = _CodeBlockScan()
+            editor = asyncio.create_task(self._run_status_editor(status_message, preview))
 
-                await self._send_code_blocks(accumulated_text, message, sent_code_blocks)
-
-                pending_update, last_update_time = await self._update_status_message(
-                    status_message, accumulated_text, last_update_time, chunk_count
-                )
+            try:
+                async for chunk in self._ai_client.generate_reply_stream(history):
+                    if not chunk:
+                        continue
 
-            text_without_code = accumulated_text
-            for match in CODE_BLOCK_RE.finditer(accumulated_text):
-                text_without_code = text_without_code.replace(match.group(0), "")
+                    preview.append(chunk)
 
-            if pending_update and text_without_code.strip():
-                safe_text = remove_markdown_stars(text_without_code)
-                formatted_text = format_message(safe_text)
-                try:
-                    await self._safe_edit(
-                        status_message, formatted_text, parse_mode=ParseMode.MARKDOWN_V2
-                    )
-                except (BadRequest, RetryAfter, TimedOut):
-                    try:
-                        await self._safe_edit(
-                            status_message,
-                            safe_text[:MAX_MESSAGE_LENGTH],
-                            parse_mode=None,
+                    # A code block can only close in a chunk that contains a backtick.
+                    if "`" in chunk:
+                        await self._send_code_blocks(
+                            preview.text, message, code_block_scan
                         )
-                    except (BadRequest, RetryAfter, TimedOut):
-                        pass
+            finally:
+                editor.cancel()
+                # A failed preview must not cost the user the generated reply.
+                try:
+                    await editor
+                except asyncio.CancelledError:
+                    pass
+                except Exception as exc:
+                    logger.warning("Превью ответа остановлено с ошибкой: {}", exc)
 
+            accumulated_text = preview.text
             if not accumulated_text:
                 accumulated_text = "Готово!"
 
             safe_reply = remove_markdown_stars(accumulated_text)
-            self._context_store.append(user.id, "assistant", safe_reply)
-
-            formatted_text = format_message(safe_reply)
+            await self._context_store.append(user.id, "assistant", safe_reply)
+
+            # Closed code blocks were already sent as their own messages while
+            # streaming, so the final edit carries only the prose around them.
+            reply_text = strip_code_blocks(safe_reply)
+            if not reply_text.strip():
+                reply_text = "Готово!"
+            formatted_text = format_message(reply_text)
             chunks = split_formatted_text(formatted_text, CHUNK_BODY_LIMIT)
 
             if len(chunks) == 1:
@@ -398,8 +443,10 @@ class TelegramAIAgent:
                     parse_mode=None,
                 )
                 for idx, chunk in enumerate(chunks, start=1):
-                    await message.reply_text(f"Часть {idx}/{len(chunks)}")
-                    await message.reply_text(chunk, parse_mode=ParseMode.MARKDOWN_V2)
+                    await message.reply_text(
+                        f"*Часть {idx}/{len(chunks)}*\n\n{chunk}",
+                        parse_mode=ParseMode.MARKDOWN_V2,
+                    )
 
         except (BadRequest, RetryAfter, TimedOut) as exc:
             logger.exception("Telegram API error: %s", exc)
@@ -441,8 +488,21 @@ class TelegramAIAgent:
             raise
 
 
+def _start_stdlib_logging() -> QueueListener:
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
 async def main() -> None:
-    logging.basicConfig(level=logging.INFO)
+    log_listener = _start_stdlib_logging()
     logs_dir = Path("logs")
     logs_dir.mkdir(parents=True, exist_ok=True)
     logger.add(
@@ -457,10 +517,18 @@ async def main() -> None:
     application = await agent.build_application()
     await application.initialize()
     await application.start()
+    agent.start()
     logger.info("Application started")
     await application.bot.delete_webhook(drop_pending_updates=True)
     await application.updater.start_polling()
     logger.info("Polling started")
+    # asyncio.run has no SIGTERM handler; without one a systemd restart would
+    # skip the cleanup below and lose dialogue rows that are not flushed yet.
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    for shutdown_signal in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(shutdown_signal, main_task.cancel)
     try:
         await asyncio.Future()
     except asyncio.CancelledError:
@@ -468,7 +536,9 @@ async def main() -> None:
     finally:
         await application.updater.stop()
         await application.stop()
+        await agent.stop()
         await application.shutdown()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+import re2
+
+from .filters import STOP_WORDS
+from .handlers import CONFERENCE_KEYWORDS
+from .web_search import WEB_SEARCH_KEYWORDS
+
+
+STOP = 1
+CONFERENCE = 2
+WEB_SEARCH = 4
+
+_CATEGORIES = (
+    (STOP, STOP_WORDS),
+    (CONFERENCE, CONFERENCE_KEYWORDS),
+    (WEB_SEARCH, WEB_SEARCH_KEYWORDS),
+)
+
+
+def _build_classifier() -> re2.Set:
+    options = re2.Options()
+    options.case_sensitive = False
+    classifier = re2.Set.SearchSet(options)
+    for _, words in _CATEGORIES:
+        classifier.Add(_alternation(words))
+    classifier.Compile()
+    return classifier
+
+
+def _alternation(words: Iterable[str]) -> str:
+    return "|".join(re2.escape(word) for word in words)
+
+
+# One RE2 DFA pass reports every category whose keywords occur in the text,
+# including keywords that overlap each other.
+_CLASSIFIER = _build_classifier()
+
+
+def classify(text: str) -> int:
+    flags = 0
+    for index in _CLASSIFIER.Match(text) or ():
+        flags |= _CATEGORIES[index][0]
+    return flags
@@ -15,8 +15,18 @@ MAX_MARKDOWN_MESSAGE = 3800
 CHUNK_BODY_LIMIT = 3400
 MAX_MESSAGE_LENGTH = 4000
 MIN_CODE_CHUNK_SIZE = 500
+FORMAT_CACHE_MAX_LENGTH = 4096
 
 UPDATE_INTERVAL = 0.5
+STREAM_PREVIEW_LENGTH = 3000
+STREAM_BATCH_INTERVAL = 0.05
+STREAM_BATCH_CHARS = 256
+
+DIALOGUE_FLUSH_INTERVAL = 1.0
+
+API_KEY_COOLDOWN = 60.0
+
+MEDIA_ENCODE_CHUNK_SIZE = 3 * 64 * 1024
 
 EXA_SEARCH_TIMEOUT = 10.0
 EXA_MAX_RESULTS = 5
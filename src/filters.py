@@ -3,6 +3,8 @@ from __future__ import annotations
 import re
 from typing import Iterable
 
+import re2
+
 
 STOP_WORDS = {
     "дурак",
@@ -18,11 +20,16 @@ STOP_WORDS = {
     "лох",
 }
 
+_STOP_WORDS_RE = re2.compile(
+    "(?i)" + "|".join(re2.escape(word) for word in sorted(STOP_WORDS))
+)
+
 
 def contains_stop_words(text: str, stop_words: Iterable[str] | None = None) -> bool:
-    words = stop_words or STOP_WORDS
+    if not stop_words:
+        return _STOP_WORDS_RE.search(text) is not None
     lowered = text.lower()
-    return any(word in lowered for word in words)
+    return any(word in lowered for word in stop_words)
 
 
 def contains_url(text: str) -> bool:
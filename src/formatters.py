@@ -1,41 +1,97 @@
 from __future__ import annotations
 
-import html
+import functools
 import re
 from typing import TYPE_CHECKING
 
+import re2
+
 if TYPE_CHECKING:
     pass
 
-from .config import MIN_CODE_CHUNK_SIZE
-
-CODE_BLOCK_RE = re.compile(r"```(\w+)?\s*(.*?)```", re.DOTALL)
-INLINE_CODE_RE = re.compile(r"`([^`]+)`")
-
-CODE_LANGUAGE_PATTERNS: list[tuple[str, re.Pattern[str]]] = [
-    ("html", re.compile(r"<!DOCTYPE html|<html\b|<body\b|</\w+>", re.IGNORECASE)),
-    ("css", re.compile(r"\b[a-zA-Z0-9_\-\.#]+\s*\{[^}]+\}", re.MULTILINE)),
-    (
-        "javascript",
-        re.compile(
-            r"\b(function|const|let|var)\s+\w+\s*(?:=|\()" r"|\bconsole\.|document\.|=>",
-            re.IGNORECASE,
-        ),
-    ),
-    ("python", re.compile(r"\b(def|class)\s+\w+\s*\(|\bimport\s+\w+", re.IGNORECASE)),
-    ("json", re.compile(r"^\s*\{[\s\S]*?:[\s\S]*?\}\s*$", re.MULTILINE)),
-    ("bash", re.compile(r"^#!/bin/(?:bash|sh)|^\s*(?:cd|ls|mkdir|rm|echo)\b", re.MULTILINE)),
+from .config import FORMAT_CACHE_MAX_LENGTH, MIN_CODE_CHUNK_SIZE
+
+MARKDOWN_V2_ESCAPES = str.maketrans({char: "\\" + char for char in r"_*[]()~`>#+-=|{}.!\\"})
+HTML_FALLBACK_TRANSLATION = str.maketrans(
+    {
+        "`": None,
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "'": "&#x27;",
+        "\n": "<br/>",
+    }
+)
+
+FENCE_LANGUAGE_RE = re.compile(r"```\w+")
+# RE2 keeps these linear: with the stdlib engine an unterminated fence, which
+# is what every streamed preview of a code block looks like, backtracks
+# quadratically.
+CODE_BLOCK_RE = re2.compile(r"(?s)```(\w+)?\s*(.*?)```")
+CODE_SPAN_RE = re2.compile(r"(?s)```(\w+)?\s*(.*?)```|`([^`]+)`")
+# Only spaces and tabs around the label: "\s" would also span newlines, and
+# under MULTILINE that backtracks quadratically over runs of blank lines.
+LABEL_LINE_PATTERN = r"^[ \t]*(?i:HTML|JavaScript|CSS|Код|Markup|Java|JS|Пример):[ \t]*$"
+# Fenced blocks are matched first and kept as-is, so headings and labels are
+# only stripped from prose in the same pass.
+HEADING_AND_LABEL_RE = re.compile(
+    r"(?P<fence>```.*?(?:```|\Z))"
+    r"|^#{1,6}\s+"
+    r"|" + LABEL_LINE_PATTERN,
+    re.MULTILINE | re.DOTALL,
+)
+FENCED_BLOCK_SPLIT_RE = re.compile(r"(```[\s\S]*?```)")
+MAX_EMPHASIS_PASSES = 3
+MARKDOWN_STARS_RE = re.compile(r"\*\*([^*]+)\*\*|\*([^*]+)\*|__([^_]+)__|_([^_]+)_")
+EDIT_TOKEN_RE = re.compile(
+    r"(?P<header>^#{1,6}\s+)"
+    r"|(?P<label>" + LABEL_LINE_PATTERN + ")"
+    r"|`(?P<code>[^`]+)`"
+    r"|(?P<special>[_*\[\]()~`>#+\-=|{}.!\\])",
+    re.MULTILINE,
+)
+
+# Every language pattern needs a Latin letter, "<", "{" or "=>" to match.
+CODE_HINT_RE = re.compile(r"[A-Za-z<{]|=>")
+CODE_LANGUAGE_PATTERNS: list[tuple[str, str]] = [
+    ("html", r"(?i)<!DOCTYPE html|<html\b|<body\b|</\w+>"),
+    ("css", r"\b[a-zA-Z0-9_\-\.#]+\s*\{[^}]+\}"),
+    ("javascript", r"(?i)\b(function|const|let|var)\s+\w+\s*(?:=|\()|\bconsole\.|document\.|=>"),
+    ("python", r"(?i)\b(def|class)\s+\w+\s*\(|\bimport\s+\w+"),
+    ("json", r"(?m)^\s*\{[\s\S]*?:[\s\S]*?\}\s*$"),
+    ("bash", r"(?m)^#!/bin/(?:bash|sh)|^\s*(?:cd|ls|mkdir|rm|echo)\b"),
 ]
 
 
+def _build_language_set() -> re2.Set:
+    language_set = re2.Set.SearchSet(re2.Options())
+    for _, pattern in CODE_LANGUAGE_PATTERNS:
+        language_set.Add(pattern)
+    language_set.Compile()
+    return language_set
+
+
+# One RE2 pass reports every language pattern that matches; the lowest index
+# wins so the priority order above is kept.
+CODE_LANGUAGE_SET = _build_language_set()
+
+
 def detect_code_language(text: str) -> tuple[bool, str | None]:
+    if len(text) <= FORMAT_CACHE_MAX_LENGTH:
+        return _detect_code_language_cached(text)
+    return _detect_code_language(text)
+
+
+def _detect_code_language(text: str) -> tuple[bool, str | None]:
     cleaned = text.strip()
     if len(cleaned) < 20:
         return False, None
 
-    for language, pattern in CODE_LANGUAGE_PATTERNS:
-        if pattern.search(cleaned):
-            return True, language
+    if CODE_HINT_RE.search(cleaned):
+        matched = CODE_LANGUAGE_SET.Match(cleaned)
+        if matched:
+            return True, CODE_LANGUAGE_PATTERNS[min(matched)][0]
 
     lines = [line for line in cleaned.splitlines() if line.strip()]
     if len(lines) < 3:
@@ -52,80 +108,91 @@ def detect_code_language(text: str) -> tuple[bool, str | None]:
     return False, None
 
 
-def escape_markdown_v2(text: str) -> str:
-    specials = r"_*[]()~`>#+-=|{}.!\\"
-    return re.sub(rf"([{re.escape(specials)}])", r"\\\1", text)
+_detect_code_language_cached = functools.lru_cache(maxsize=512)(_detect_code_language)
 
 
-def remove_markdown_stars(text: str) -> str:
-    code_blocks: list[str] = []
-    code_block_pattern = re.compile(r"```[\s\S]*?```")
+def strip_code_blocks(text: str) -> str:
+    return CODE_BLOCK_RE.sub("", text)
+
 
-    def replace_code_block(match: re.Match) -> str:
-        code_blocks.append(match.group(0))
-        return f"__PLACEHOLDER_CODE_{len(code_blocks) - 1}_UNIQUE__"
+def escape_markdown_v2(text: str) -> str:
+    return text.translate(MARKDOWN_V2_ESCAPES)
 
-    text_no_code = code_block_pattern.sub(replace_code_block, text)
 
-    text_no_code = re.sub(r"\*\*([^*]+)\*\*", r"\1", text_no_code)
-    text_no_code = re.sub(r"\*([^*]+)\*", r"\1", text_no_code)
-    text_no_code = re.sub(r"__([^_]+)__", r"\1", text_no_code)
-    text_no_code = re.sub(r"_([^_]+)_", r"\1", text_no_code)
+def _edit_token_replacer(match: re.Match) -> str:
+    kind = match.lastgroup
+    if kind == "special":
+        return "\\" + match.group(0)
+    if kind == "code":
+        return "`" + match.group("code").replace("\\", "\\\\") + "`"
+    return ""
 
-    for idx, code_block in enumerate(code_blocks):
-        text_no_code = text_no_code.replace(f"__PLACEHOLDER_CODE_{idx}_UNIQUE__", code_block)
 
-    return text_no_code
+def prepare_for_edit(text: str) -> str:
+    return EDIT_TOKEN_RE.sub(_edit_token_replacer, _strip_emphasis_markers(text))
 
 
-def format_message(text: str) -> str:
-    text = re.sub(r"^#{1,6}\s+", "", text, flags=re.MULTILINE)
-    text = re.sub(
-        r"^\s*(HTML|JavaScript|CSS|Код|Markup|Java|JS|Пример):\s*$",
-        "",
-        text,
-        flags=re.IGNORECASE | re.MULTILINE,
-    )
+def _strip_emphasis(match: re.Match) -> str:
+    return next(group for group in match.groups() if group is not None)
+
+
+def _strip_emphasis_markers(text: str) -> str:
+    # Nested markers such as "***x***" or "**_x_**" need another pass once the
+    # outer pair is gone. The passes are capped: a long run like "*" * 1500
+    # would otherwise lose one pair per pass and go quadratic.
+    for _ in range(MAX_EMPHASIS_PASSES):
+        text, count = MARKDOWN_STARS_RE.subn(_strip_emphasis, text)
+        if not count:
+            break
+    return text
 
-    detection_candidate = text.strip()
 
-    placeholders: list[tuple[str, str]] = []
+def remove_markdown_stars(text: str) -> str:
+    parts = FENCED_BLOCK_SPLIT_RE.split(text)
+    parts[::2] = [_strip_emphasis_markers(part) for part in parts[::2]]
+    return "".join(parts)
 
-    def add_placeholder(content: str) -> str:
-        token = f"__MD_SNIPPET_{len(placeholders)}__"
-        placeholders.append((token, content))
-        return token
 
-    def block_replacer(match: re.Match) -> str:
-        language = (match.group(1) or "").strip()
-        code = match.group(2).strip("\n")
-        if not code or code.strip() == "":
-            return match.group(0)
-        lang_prefix = f"{language}\n" if language else "\n"
-        snippet = f"```{lang_prefix}{code}\n```"
-        return add_placeholder(snippet)
+def _keep_fence(match: re.Match) -> str:
+    return match.group("fence") or ""
 
-    text_no_blocks = CODE_BLOCK_RE.sub(block_replacer, text)
 
-    text_no_blocks = re.sub(r"__PLACEHOLDER_CODE_\d+_UNIQUE__", "", text_no_blocks)
-    text_no_blocks = re.sub(r"_PLACEHOLDER[^_]*_", "", text_no_blocks)
+def format_message(text: str) -> str:
+    if len(text) <= FORMAT_CACHE_MAX_LENGTH:
+        return _format_message_cached(text)
+    return _format_message(text)
 
-    def inline_replacer(match: re.Match) -> str:
-        content = match.group(1)
-        if not content:
-            return match.group(0)
-        snippet = f"`{content}`"
-        return add_placeholder(snippet)
 
-    text_no_code = INLINE_CODE_RE.sub(inline_replacer, text_no_blocks)
+def _format_code_span(match: re2._Match) -> str | None:
+    inline = match.group(3)
+    if inline is not None:
+        return f"`{inline}`"
+    code = match.group(2).strip("\n")
+    if not code.strip():
+        return None
+    return f"```{match.group(1) or ''}\n{code}\n```"
 
-    escaped_text = escape_markdown_v2(text_no_code)
 
-    for token, snippet in placeholders:
-        escaped_token = escape_markdown_v2(token)
-        escaped_text = escaped_text.replace(escaped_token, snippet)
+def _format_message(text: str) -> str:
+    if "#" in text or ":" in text:
+        text = HEADING_AND_LABEL_RE.sub(_keep_fence, text)
 
-    if not placeholders:
+    parts: list[str] = []
+    has_code = False
+    last_end = 0
+    if "`" in text:
+        for match in CODE_SPAN_RE.finditer(text):
+            snippet = _format_code_span(match)
+            if snippet is None:
+                continue
+            parts.append(escape_markdown_v2(text[last_end : match.start()]))
+            parts.append(snippet)
+            last_end = match.end()
+            has_code = True
+    parts.append(escape_markdown_v2(text[last_end:]))
+
+    if not has_code:
+        detection_candidate = text.strip()
         looks_like_code, language_hint = detect_code_language(detection_candidate)
         if looks_like_code:
             code_body = detection_candidate.strip("\n")
@@ -133,30 +200,35 @@ def format_message(text: str) -> str:
                 return f"```{language_hint}\n{code_body}\n```"
             return f"```\n{code_body}\n```"
 
-    return escaped_text
+    return "".join(parts)
+
+
+_format_message_cached = functools.lru_cache(maxsize=512)(_format_message)
 
 
 def format_html_fallback(text: str) -> str:
-    clean = re.sub(r"```(\w+)?", "", text)
-    clean = clean.replace("```", "")
-    clean = re.sub(r"`", "", clean)
-    return html.escape(clean).replace("\n", "<br/>")
+    if "```" in text:
+        text = FENCE_LANGUAGE_RE.sub("", text)
+    return text.translate(HTML_FALLBACK_TRANSLATION)
 
 
 def split_plain_text(text: str, limit: int) -> list[str]:
     if len(text) <= limit:
         return [text]
     parts: list[str] = []
+    length = len(text)
     start = 0
-    while start < len(text):
-        end = min(len(text), start + limit)
-        if end < len(text):
+    while start < length:
+        end = min(length, start + limit)
+        if end < length:
             newline = text.rfind("\n", start, end)
             if newline > start:
                 end = newline + 1
-        parts.append(text[start:end])
+        part = text[start:end].strip("\n")
+        if part:
+            parts.append(part)
         start = end
-    return [part.strip("\n") for part in parts if part.strip("\n")]
+    return parts
 
 
 def split_formatted_text(text: str, limit: int) -> list[str]:
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import functools
 from pathlib import Path
 
+import re2
 from loguru import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
@@ -21,6 +23,24 @@ SYSTEM_PROMPT = (
 
 CONFERENCE_INFO_PATH = Path(__file__).parent.parent / "Tatar_San_2025_Full_Info.md"
 
+CONFERENCE_KEYWORDS = (
+    "татар сан",
+    "татарсан",
+    "конференция",
+    "футуршок",
+    "хакатон",
+    "королева кода",
+    "спикер",
+    "программа",
+    "расписание",
+    "казань",
+    "22 ноября",
+    "ит-парк",
+)
+_CONFERENCE_RE = re2.compile(
+    "(?i)" + "|".join(re2.escape(keyword) for keyword in CONFERENCE_KEYWORDS)
+)
+
 MENU_CALLBACKS = {
     "CMD_HELP": "help",
     "CMD_ABOUT": "about",
@@ -44,47 +64,67 @@ def build_menu() -> InlineKeyboardMarkup:
 
 def load_conference_info() -> str | None:
     try:
-        if CONFERENCE_INFO_PATH.exists():
-            return CONFERENCE_INFO_PATH.read_text(encoding="utf-8")
+        mtime_ns = CONFERENCE_INFO_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        logger.warning("Не удалось загрузить информацию о конференции: %s", exc)
+        return None
+    return _read_conference_info(mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def _read_conference_info(mtime_ns: int) -> str | None:
+    try:
+        return CONFERENCE_INFO_PATH.read_text(encoding="utf-8")
     except Exception as exc:
         logger.warning("Не удалось загрузить информацию о конференции: %s", exc)
     return None
 
 
+def get_conference_context() -> str | None:
+    conference_info = load_conference_info()
+    if not conference_info:
+        return None
+    return _build_conference_context(conference_info)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_conference_context(conference_info: str) -> str:
+    return f"Полная информация о конференции ТАТАР САН 2025:\n\n{conference_info}"
+
+
 def is_conference_question(text: str) -> bool:
-    text_lower = text.lower()
-    keywords = [
-        "татар сан",
-        "татарсан",
-        "конференция",
-        "футуршок",
-        "хакатон",
-        "королева кода",
-        "спикер",
-        "программа",
-        "расписание",
-        "казань",
-        "22 ноября",
-        "ит-парк",
-    ]
-    return any(keyword in text_lower for keyword in keywords)
+    return _CONFERENCE_RE.search(text) is not None
 
 
 def get_user_info(user) -> str:
     if not user:
         return ""
+    return _format_user_info(
+        user.first_name, user.last_name, user.username, user.id, user.language_code
+    )
+
 
+@functools.lru_cache(maxsize=1024)
+def _format_user_info(
+    first_name: str | None,
+    last_name: str | None,
+    username: str | None,
+    user_id: int | None,
+    language_code: str | None,
+) -> str:
     info_parts = []
-    if user.first_name:
-        info_parts.append(f"Имя: {user.first_name}")
-    if user.last_name:
-        info_parts.append(f"Фамилия: {user.last_name}")
-    if user.username:
-        info_parts.append(f"Username: @{user.username}")
-    if user.id:
-        info_parts.append(f"ID: {user.id}")
-    if user.language_code:
-        info_parts.append(f"Язык: {user.language_code}")
+    if first_name:
+        info_parts.append(f"Имя: {first_name}")
+    if last_name:
+        info_parts.append(f"Фамилия: {last_name}")
+    if username:
+        info_parts.append(f"Username: @{username}")
+    if user_id:
+        info_parts.append(f"ID: {user_id}")
+    if language_code:
+        info_parts.append(f"Язык: {language_code}")
 
     if info_parts:
         return "Информация о пользователе:\n" + "\n".join(info_parts)
@@ -94,14 +134,18 @@ def get_user_info(user) -> str:
 def get_bot_info_text(bot_info: dict | None) -> str:
     if not bot_info:
         return ""
-    
+    return _format_bot_info(bot_info.get("first_name"), bot_info.get("username"), bot_info.get("id"))
+
+
+@functools.lru_cache(maxsize=8)
+def _format_bot_info(first_name: str | None, username: str | None, bot_id: int | None) -> str:
     bot_info_text = "Информация о боте:\n"
-    if bot_info.get("first_name"):
-        bot_info_text += f"Имя бота: {bot_info['first_name']}\n"
-    if bot_info.get("username"):
-        bot_info_text += f"Username бота: @{bot_info['username']}\n"
-    if bot_info.get("id"):
-        bot_info_text += f"ID бота: {bot_info['id']}\n"
+    if first_name:
+        bot_info_text += f"Имя бота: {first_name}\n"
+    if username:
+        bot_info_text += f"Username бота: @{username}\n"
+    if bot_id:
+        bot_info_text += f"ID бота: {bot_id}\n"
     bot_info_text += "\nИспользуй эту информацию для ответа на вопросы о боте."
     return bot_info_text
 
@@ -125,7 +169,7 @@ async def handle_start(
     if user:
         logger.info("User %s started bot", user.id)
 
-        dialogue = context_store.get(user.id)
+        dialogue = await context_store.get(user.id)
         if not dialogue.export():
             context_parts = []
 
@@ -142,7 +186,7 @@ async def handle_start(
                     "\n\n".join(context_parts)
                     + "\n\nИспользуй эту информацию для ответа на вопросы пользователя о себе или о боте (имя, username и т.д.)."
                 )
-                context_store.append(user.id, "system", full_context)
+                await context_store.append(user.id, "system", full_context)
 
 
 async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -169,7 +213,7 @@ async def handle_reset(
 ) -> None:
     user_id = update.effective_user.id if update.effective_user else None
     if user_id is not None:
-        context_store.reset(user_id)
+        await context_store.reset(user_id)
     await _reply(update, "Контекст очищен. Можем начать заново!", reply_markup=build_menu())
 
 
@@ -1,12 +1,29 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from .config import MEDIA_ENCODE_CHUNK_SIZE
+
 if TYPE_CHECKING:
-    from telegram import Audio, PhotoSize, Voice
+    from telegram import Audio, File, PhotoSize, Voice
+
+
+def _encode_base64(data: bytearray) -> str:
+    encoded = bytearray()
+    with memoryview(data) as view:
+        for start in range(0, len(view), MEDIA_ENCODE_CHUNK_SIZE):
+            encoded += base64.b64encode(view[start : start + MEDIA_ENCODE_CHUNK_SIZE])
+    data.clear()
+    return encoded.decode("ascii")
+
+
+async def _download_base64(file: File) -> str:
+    data = await file.download_as_bytearray()
+    return await asyncio.to_thread(_encode_base64, data)
 
 
 async def get_photo_base64(photo: list[PhotoSize] | None) -> str | None:
@@ -14,8 +31,7 @@ async def get_photo_base64(photo: list[PhotoSize] | None) -> str | None:
         return None
     try:
         file = await photo[-1].get_file()
-        photo_bytes = await file.download_as_bytearray()
-        return base64.b64encode(photo_bytes).decode("utf-8")
+        return await _download_base64(file)
     except Exception as exc:
         logger.warning("Не удалось получить фото: %s", exc)
         return None
@@ -26,9 +42,7 @@ async def get_audio_base64(audio: Audio | Voice | None) -> str | None:
         return None
     try:
         file = await audio.get_file()
-        audio_bytes = await file.download_as_bytearray()
-        return base64.b64encode(audio_bytes).decode("utf-8")
+        return await _download_base64(file)
     except Exception as exc:
         logger.warning("Не удалось получить аудио: %s", exc)
         return None
-
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from collections import deque
+import asyncio
 from dataclasses import dataclass, field
-from typing import Deque, Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
 
 from .storage import DialogueStorage
 
@@ -14,45 +16,128 @@ Message = dict
 class DialogueState:
     user_id: int
     max_messages: int = 12
-    history: Deque[Message] = field(default_factory=deque)
+    _buffer: List[Optional[Message]] = field(init=False, repr=False)
+    _head: int = field(default=0, init=False, repr=False)
+    _size: int = field(default=0, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._buffer = [None] * self.max_messages
+
+    def append(self, role: str, content: str | list | dict) -> bool:
+        return self._push({"role": role, "content": content})
 
-    def append(self, role: str, content: str | list | dict) -> None:
-        self.history.append({"role": role, "content": content})
-        while len(self.history) > self.max_messages:
-            self.history.popleft()
+    def extend(self, messages: Iterable[Message]) -> None:
+        for message in messages:
+            self._push(message)
+
+    def _push(self, message: Message) -> bool:
+        if self._size < self.max_messages:
+            self._buffer[(self._head + self._size) % self.max_messages] = message
+            self._size += 1
+            return False
+        self._buffer[self._head] = message
+        self._head = (self._head + 1) % self.max_messages
+        return True
 
     def reset(self) -> None:
-        self.history.clear()
+        self._buffer = [None] * self.max_messages
+        self._head = 0
+        self._size = 0
 
     def export(self) -> List[Message]:
-        return list(self.history)
+        end = self._head + self._size
+        if end <= self.max_messages:
+            return self._buffer[self._head : end]
+        return self._buffer[self._head :] + self._buffer[: end - self.max_messages]
 
 
 class ContextStore:
-    def __init__(self, max_messages: int = 12, storage: Optional[DialogueStorage] = None):
+    def __init__(
+        self,
+        max_messages: int = 12,
+        storage: Optional[DialogueStorage] = None,
+        flush_batch_size: int = 50,
+    ):
         self._store: Dict[int, DialogueState] = {}
         self._max_messages = max_messages
         self._storage = storage
+        self._flush_batch_size = flush_batch_size
+        self._pending_rows: List[Tuple[int, str, str | list | dict]] = []
+        self._trim_users: Set[int] = set()
+        self._resetting: Dict[int, int] = {}
+        self._write_lock = asyncio.Lock()
 
-    def get(self, user_id: int) -> DialogueState:
+    async def get(self, user_id: int) -> DialogueState:
         if user_id not in self._store:
             state = DialogueState(user_id=user_id, max_messages=self._max_messages)
             if self._storage:
-                history = self._storage.load_history(user_id, self._max_messages)
-                for entry in history[-self._max_messages :]:
-                    state.history.append(entry)
-            self._store[user_id] = state
+                history = await asyncio.to_thread(
+                    self._storage.load_history, user_id, self._max_messages
+                )
+                state.extend(history)
+            return self._store.setdefault(user_id, state)
         return self._store[user_id]
 
-    def append(self, user_id: int, role: str, content: str | list | dict) -> None:
-        state = self.get(user_id)
-        state.append(role, content)
+    async def append(self, user_id: int, role: str, content: str | list | dict) -> None:
+        state = await self.get(user_id)
+        evicted = state.append(role, content)
         if self._storage:
-            self._storage.replace_history(user_id, state.export())
+            self._pending_rows.append((user_id, role, content))
+            if evicted:
+                self._trim_users.add(user_id)
+            if len(self._pending_rows) >= self._flush_batch_size:
+                await self.flush()
 
-    def reset(self, user_id: int) -> None:
+    async def reset(self, user_id: int) -> None:
         if user_id in self._store:
             self._store[user_id].reset()
         if self._storage:
-            self._storage.reset_user(user_id)
+            self._pending_rows = [row for row in self._pending_rows if row[0] != user_id]
+            self._trim_users.discard(user_id)
+            self._resetting[user_id] = self._resetting.get(user_id, 0) + 1
+            try:
+                async with self._write_lock:
+                    await asyncio.to_thread(self._storage.reset_user, user_id)
+            finally:
+                if self._resetting[user_id] == 1:
+                    del self._resetting[user_id]
+                else:
+                    self._resetting[user_id] -= 1
+
+    async def flush(self) -> None:
+        if not self._storage:
+            return
+        async with self._write_lock:
+            if self._pending_rows:
+                rows = self._pending_rows
+                self._pending_rows = []
+                if self._resetting:
+                    # Rows appended while a reset waits for the lock must be
+                    # written after its DELETE, not before.
+                    self._pending_rows = [row for row in rows if row[0] in self._resetting]
+                    rows = [row for row in rows if row[0] not in self._resetting]
+                try:
+                    await asyncio.to_thread(self._storage.append_many, rows)
+                except Exception:
+                    self._pending_rows[:0] = rows
+                    raise
+            if self._trim_users:
+                trim_users = self._trim_users
+                self._trim_users = set()
+                try:
+                    await asyncio.to_thread(self._trim, trim_users)
+                except Exception:
+                    self._trim_users.update(trim_users)
+                    raise
+
+    def _trim(self, user_ids: Set[int]) -> None:
+        for user_id in user_ids:
+            self._storage.trim(user_id, self._max_messages)
 
+    async def run_flush_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.warning("Не удалось сохранить историю диалогов: {}", exc)
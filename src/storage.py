@@ -1,9 +1,12 @@
 from __future__ import annotations
 
-import json
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, List, Sequence
+from typing import Any, Iterable, Iterator, List, Sequence
+
+import orjson
 
 
 SCHEMA = """
@@ -12,29 +15,74 @@ CREATE TABLE IF NOT EXISTS dialogue_messages (
     user_id INTEGER NOT NULL,
     role TEXT NOT NULL,
     content TEXT NOT NULL,
+    content_type TEXT NOT NULL DEFAULT 'str',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 CREATE INDEX IF NOT EXISTS idx_dialogue_messages_user ON dialogue_messages(user_id, id);
 """
 
 
+PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=67108864;
+"""
+
+
+# Databases created before content_type existed stored list/dict content as
+# JSON and everything else as plain text.
+CONTENT_TYPE_MIGRATION = """
+BEGIN IMMEDIATE;
+ALTER TABLE dialogue_messages ADD COLUMN content_type TEXT NOT NULL DEFAULT 'str';
+UPDATE dialogue_messages
+SET content_type = 'json'
+WHERE substr(content, 1, 1) IN ('[', '{') AND json_valid(content);
+COMMIT;
+"""
+
+
+def _serialize_content(content: str | list | dict) -> tuple[str, str]:
+    if isinstance(content, str):
+        return content, "str"
+    return orjson.dumps(content).decode("utf-8"), "json"
+
+
 class DialogueStorage:
     def __init__(self, db_path: Path) -> None:
         self._db_path = db_path
         self._db_path.parent.mkdir(parents=True, exist_ok=True)
-        with self._connect() as conn:
-            conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._db_path, check_same_thread=False, isolation_level=None)
+        self._conn.executescript(PRAGMAS)
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(dialogue_messages)")}
+        if "content_type" not in columns:
+            self._conn.executescript(CONTENT_TYPE_MIGRATION)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
 
-    def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
 
     def load_history(self, user_id: int, limit: int) -> List[dict[str, Any]]:
-        with self._connect() as conn:
-            rows = conn.execute(
+        with self._lock:
+            rows = self._conn.execute(
                 """
-                SELECT role, content
+                SELECT role, content, content_type
                 FROM dialogue_messages
                 WHERE user_id = ?
                 ORDER BY id DESC
@@ -42,39 +90,54 @@ class DialogueStorage:
                 """,
                 (user_id, limit),
             ).fetchall()
-        result = []
-        for row in reversed(rows):
-            content = row["content"]
-            try:
-                content = json.loads(content)
-            except (json.JSONDecodeError, TypeError):
-                pass
-            result.append({"role": row["role"], "content": content})
-        return result
+        return [
+            {"role": role, "content": orjson.loads(content) if content_type == "json" else content}
+            for role, content, content_type in reversed(rows)
+        ]
 
     def append(self, user_id: int, role: str, content: str | list | dict) -> None:
-        with self._connect() as conn:
-            content_str = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        content_str, content_type = _serialize_content(content)
+        with self._transaction() as conn:
             conn.execute(
-                "INSERT INTO dialogue_messages (user_id, role, content) VALUES (?, ?, ?)",
-                (user_id, role, content_str),
+                "INSERT INTO dialogue_messages (user_id, role, content, content_type) VALUES (?, ?, ?, ?)",
+                (user_id, role, content_str, content_type),
+            )
+
+    def append_many(self, rows: Iterable[tuple[int, str, str | list | dict]]) -> None:
+        params = [(user_id, role, *_serialize_content(content)) for user_id, role, content in rows]
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO dialogue_messages (user_id, role, content, content_type) VALUES (?, ?, ?, ?)",
+                params,
+            )
+
+    def trim(self, user_id: int, keep: int) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                DELETE FROM dialogue_messages
+                WHERE user_id = ?
+                  AND id <= (
+                    SELECT id
+                    FROM dialogue_messages
+                    WHERE user_id = ?
+                    ORDER BY id DESC
+                    LIMIT 1 OFFSET ?
+                  )
+                """,
+                (user_id, user_id, keep),
             )
 
     def replace_history(self, user_id: int, messages: Sequence[dict]) -> None:
-        with self._connect() as conn:
+        rows = [(user_id, msg["role"], *_serialize_content(msg["content"])) for msg in messages]
+        with self._transaction() as conn:
             conn.execute("DELETE FROM dialogue_messages WHERE user_id = ?", (user_id,))
-            rows = []
-            for msg in messages:
-                content = msg["content"]
-                if not isinstance(content, str):
-                    content = json.dumps(content, ensure_ascii=False)
-                rows.append((user_id, msg["role"], content))
             conn.executemany(
-                "INSERT INTO dialogue_messages (user_id, role, content) VALUES (?, ?, ?)",
+                "INSERT INTO dialogue_messages (user_id, role, content, content_type) VALUES (?, ?, ?, ?)",
                 rows,
             )
 
     def reset_user(self, user_id: int) -> None:
-        with self._connect() as conn:
+        with self._transaction() as conn:
             conn.execute("DELETE FROM dialogue_messages WHERE user_id = ?", (user_id,))
 
@@ -5,6 +5,7 @@ from datetime import datetime
 from typing import TYPE_CHECKING
 
 import httpx
+import re2
 from loguru import logger
 
 from .config import EXA_MAX_RESULTS, EXA_MAX_TEXT_LENGTH, EXA_SEARCH_TIMEOUT
@@ -13,61 +14,86 @@ if TYPE_CHECKING:
     pass
 
 
+WEB_SEARCH_KEYWORDS = (
+    "погода",
+    "погод",
+    "температура",
+    "новости",
+    "новость",
+    "курс",
+    "курс валют",
+    "цена",
+    "стоимость",
+    "сколько стоит",
+    "что происходит",
+    "последние",
+    "сегодня",
+    "сейчас",
+    "актуальн",
+    "актуальная",
+    "тренд",
+    "события",
+    "событие",
+    "календарь",
+    "дата",
+    "число",
+    "какое число",
+    "какая дата",
+    "какой день",
+    "какое сегодня число",
+    "какая сегодня дата",
+    "какой сегодня день",
+    "год",
+    "какой год",
+    "какой сейчас год",
+    "месяц",
+    "какой месяц",
+    "день недели",
+    "какой день недели",
+    "время",
+    "который час",
+    "сколько времени",
+    "поищи в интернете",
+    "поиск в интернете",
+    "найди в интернете",
+    "поискать в интернете",
+    "поиск",
+    "найди",
+    "найти",
+    "поищи",
+    "в интернете",
+    "в сети",
+    "в гугле",
+    "в яндексе",
+)
+_WEB_SEARCH_RE = re2.compile(
+    "(?i)" + "|".join(re2.escape(keyword) for keyword in WEB_SEARCH_KEYWORDS)
+)
+
+DATE_KEYWORDS = ("число", "дата", "день", "год", "месяц", "календарь")
+
+_exa_client: httpx.AsyncClient | None = None
+
+
+def _get_exa_client() -> httpx.AsyncClient:
+    global _exa_client
+    if _exa_client is None:
+        _exa_client = httpx.AsyncClient(
+            base_url="https://api.exa.ai",
+            timeout=EXA_SEARCH_TIMEOUT,
+        )
+    return _exa_client
+
+
+async def close_search_client() -> None:
+    global _exa_client
+    if _exa_client is not None:
+        await _exa_client.aclose()
+        _exa_client = None
+
+
 def needs_web_search(text: str) -> bool:
-    text_lower = text.lower()
-    search_keywords = [
-        "погода",
-        "погод",
-        "температура",
-        "новости",
-        "новость",
-        "курс",
-        "курс валют",
-        "цена",
-        "стоимость",
-        "сколько стоит",
-        "что происходит",
-        "последние",
-        "сегодня",
-        "сейчас",
-        "актуальн",
-        "актуальная",
-        "тренд",
-        "события",
-        "событие",
-        "календарь",
-        "дата",
-        "число",
-        "какое число",
-        "какая дата",
-        "какой день",
-        "какое сегодня число",
-        "какая сегодня дата",
-        "какой сегодня день",
-        "год",
-        "какой год",
-        "какой сейчас год",
-        "месяц",
-        "какой месяц",
-        "день недели",
-        "какой день недели",
-        "время",
-        "который час",
-        "сколько времени",
-        "поищи в интернете",
-        "поиск в интернете",
-        "найди в интернете",
-        "поискать в интернете",
-        "поиск",
-        "найди",
-        "найти",
-        "поищи",
-        "в интернете",
-        "в сети",
-        "в гугле",
-        "в яндексе",
-    ]
-    return any(keyword in text_lower for keyword in search_keywords)
+    return _WEB_SEARCH_RE.search(text) is not None
 
 
 async def search_web(query: str) -> str | None:
@@ -77,38 +103,36 @@ async def search_web(query: str) -> str | None:
             logger.debug("EXA_API_KEY не установлен")
             return None
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.exa.ai/search",
-                headers={
-                    "x-api-key": exa_api_key,
-                    "Content-Type": "application/json",
+        response = await _get_exa_client().post(
+            "/search",
+            headers={
+                "x-api-key": exa_api_key,
+                "Content-Type": "application/json",
+            },
+            json={
+                "query": query,
+                "num_results": EXA_MAX_RESULTS,
+                "contents": {
+                    "text": {"max_characters": EXA_MAX_TEXT_LENGTH},
                 },
-                json={
-                    "query": query,
-                    "num_results": EXA_MAX_RESULTS,
-                    "contents": {
-                        "text": {"max_characters": EXA_MAX_TEXT_LENGTH},
-                    },
-                },
-                timeout=EXA_SEARCH_TIMEOUT,
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            results = data.get("results", [])
-            if results:
-                search_context = ""
-                for idx, item in enumerate(results[:EXA_MAX_RESULTS], 1):
-                    title = item.get("title", "")
-                    url = item.get("url", "")
-                    text_content = (
-                        item.get("text", "")[:EXA_MAX_TEXT_LENGTH]
-                        if item.get("text")
-                        else ""
-                    )
-                    search_context += f"{idx}. {title}\nURL: {url}\n{text_content}\n\n"
-                return search_context.strip()
+            },
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        results = data.get("results", [])
+        if results:
+            search_parts = []
+            for idx, item in enumerate(results[:EXA_MAX_RESULTS], 1):
+                title = item.get("title", "")
+                url = item.get("url", "")
+                text_content = (
+                    item.get("text", "")[:EXA_MAX_TEXT_LENGTH]
+                    if item.get("text")
+                    else ""
+                )
+                search_parts.append(f"{idx}. {title}\nURL: {url}\n{text_content}\n")
+            return "\n".join(search_parts).strip()
     except httpx.HTTPError as exc:
         logger.debug("Ошибка HTTP при поиске через Exa: %s", exc)
     except Exception as exc:
@@ -118,7 +142,7 @@ async def search_web(query: str) -> str | None:
 
 def build_search_query(text: str) -> str:
     text_lower = text.lower()
-    if any(word in text_lower for word in ["число", "дата", "день", "год", "месяц", "календарь"]):
+    if any(word in text_lower for word in DATE_KEYWORDS):
         if "сегодня" in text_lower or "сейчас" in text_lower:
             return f"какое сегодня число дата {datetime.now().strftime('%Y-%m-%d')}"
         return f"актуальная информация {text}"
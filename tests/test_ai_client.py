@@ -1,3 +1,6 @@
+import json
+import warnings
+
 import pytest
 from types import SimpleNamespace
 from unittest.mock import AsyncMock
@@ -112,8 +115,99 @@ async def test_ai_client_streaming(monkeypatch):
     ):
         chunks.append(chunk)
 
-    assert chunks == ["Hello", " ", "World"]
+    assert chunks == ["Hello", " World"]
     mock_create.assert_awaited_once()
     called_kwargs = mock_create.call_args.kwargs
     assert called_kwargs["stream"] is True
 
+
+def test_normalize_messages_wraps_single_content_part():
+    settings = Settings(
+        bot_token="test-token",
+        api_key="sk-test",
+        api_keys=("sk-test",),
+        base_url="https://api.mapleai.de/v1",
+        model_name="gpt-4o",
+    )
+    client = AIClient(settings)
+    part = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AA=="}}
+
+    canonical = [{"role": "user", "content": "hi"}, {"role": "user", "content": [part]}]
+    assert client._normalize_messages(canonical) == canonical
+
+    normalized = client._normalize_messages(
+        [{"role": "user", "content": part}, {"role": "assistant", "content": 42}]
+    )
+    assert normalized == [
+        {"role": "user", "content": [part]},
+        {"role": "assistant", "content": "42"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ai_client_streams_multimodal_payload_with_prebuilt_body(monkeypatch):
+    settings = Settings(
+        bot_token="test-token",
+        api_key="sk-test",
+        api_keys=("sk-test",),
+        base_url="https://api.mapleai.de/v1",
+        model_name="gpt-4o",
+    )
+    client = AIClient(settings)
+    content = [
+        {"type": "text", "text": "Что на фото?"},
+        {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AA=="}},
+    ]
+
+    async def fake_stream():
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Кот"))])
+
+    mock_request = AsyncMock(side_effect=lambda *args, **kwargs: fake_stream())
+    mock_create = AsyncMock()
+    monkeypatch.setattr(client._client, "request", mock_request)
+    monkeypatch.setattr(client._client.chat.completions, "create", mock_create)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        chunks = [
+            chunk
+            async for chunk in client.generate_reply_stream(
+                [{"role": "user", "content": content}]
+            )
+        ]
+
+    assert chunks == ["Кот"]
+    mock_create.assert_not_awaited()
+    request = client._client._build_request(mock_request.call_args.args[1])
+    assert request.method == "POST"
+    assert request.url.path.endswith("/chat/completions")
+    assert request.headers["Content-Type"] == "application/json"
+    sent = json.loads(request.read())
+    assert sent["messages"] == [{"role": "user", "content": content}]
+    assert sent["stream"] is True
+
+
+def test_ai_client_rotation_skips_keys_on_cooldown():
+    settings = Settings(
+        bot_token="test-token",
+        api_key="sk-a",
+        api_keys=("sk-a", "sk-b", "sk-c"),
+        base_url="https://api.mapleai.de/v1",
+        model_name="gpt-4o",
+    )
+    client = AIClient(settings)
+    clients = list(client._clients)
+
+    assert client._rotate_key()
+    assert client._current_key_idx == 1
+    assert client._rotate_key()
+    assert client._current_key_idx == 2
+    assert client._rotate_key()
+    assert client._current_key_idx == 0
+    assert client._client is clients[0]
+
+    client._key_cooldowns.clear()
+    client._key_cooldowns[1] = float("inf")
+    assert client._rotate_key()
+    assert client._current_key_idx == 2
+    assert client._clients == clients
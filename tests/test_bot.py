@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.error import NetworkError
+
+from src import bot
+from src.bot import TelegramAIAgent
+from src.config import Settings
+
+
+def _build_agent(tmp_path, chunks, delay=0.0):
+    settings = Settings(
+        bot_token="test-token",
+        api_key="sk-test",
+        api_keys=("sk-test",),
+        base_url="https://api.mapleai.de/v1",
+        model_name="gpt-4o",
+        dialogue_db_path=str(tmp_path / "dialogues.db"),
+    )
+    agent = TelegramAIAgent(settings)
+    agent._bot_info = {"id": 1, "username": "bot", "first_name": "Bot"}
+
+    async def fake_stream(history, **kwargs):
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+    agent._ai_client.generate_reply_stream = fake_stream
+    return agent
+
+
+def _build_update(text):
+    status_message = MagicMock()
+    status_message.edit_text = AsyncMock()
+    message = MagicMock(text=text, caption=None, photo=None, audio=None, voice=None)
+    message.reply_text = AsyncMock(return_value=status_message)
+    update = SimpleNamespace(effective_message=message, effective_user=SimpleNamespace(id=5))
+    return update, message, status_message
+
+
+@pytest.mark.asyncio
+async def test_on_message_sends_each_code_block_once(tmp_path):
+    agent = _build_agent(
+        tmp_path, ["Вот код:\n```py", "thon\nprint(1)\n```", "\nГотово."]
+    )
+    update, message, status_message = _build_update("покажи код")
+
+    await agent.on_message(update, SimpleNamespace(bot=None))
+
+    replies = [call.args[0] for call in message.reply_text.await_args_list]
+    edits = [call.args[0] for call in status_message.edit_text.await_args_list]
+    assert replies.count("```python\nprint(1)\n```") == 1
+    assert not any("print(1)" in text for text in edits)
+    assert edits[-1] == "Вот код:\n\nГотово\\."
+
+    state = await agent._context_store.get(5)
+    assert "print(1)" in state.export()[-1]["content"]
+    agent._storage.close()
+
+
+@pytest.mark.asyncio
+async def test_on_message_survives_preview_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "UPDATE_INTERVAL", 0.01)
+    agent = _build_agent(tmp_path, ["Первая часть. ", "Вторая часть."], delay=0.05)
+    update, _message, status_message = _build_update("привет")
+    edits = []
+
+    async def edit_text(text, **kwargs):
+        edits.append(text)
+        if len(edits) == 1:
+            raise NetworkError("Connection reset")
+
+    status_message.edit_text = edit_text
+
+    await agent.on_message(update, SimpleNamespace(bot=None))
+
+    assert len(edits) > 1
+    assert edits[-1] == "Первая часть\\. Вторая часть\\."
+    state = await agent._context_store.get(5)
+    assert state.export()[-1] == {"role": "assistant", "content": "Первая часть. Вторая часть."}
+    agent._storage.close()
@@ -0,0 +1,14 @@
+from src.classifiers import CONFERENCE, STOP, WEB_SEARCH, classify
+
+
+def test_classify_plain_text_has_no_flags():
+    assert classify("Расскажи анекдот") == 0
+
+
+def test_classify_reports_every_matching_category():
+    flags = classify("Какая сегодня ПОГОДА в Казань на конференции, дурак?")
+    assert flags == STOP | CONFERENCE | WEB_SEARCH
+
+
+def test_classify_matches_overlapping_keywords():
+    assert classify("хакатоновости") == CONFERENCE | WEB_SEARCH
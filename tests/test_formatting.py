@@ -1,4 +1,13 @@
-from src.formatters import format_message, split_formatted_text
+import time
+
+from src.formatters import (
+    detect_code_language,
+    escape_markdown_v2,
+    format_message,
+    prepare_for_edit,
+    remove_markdown_stars,
+    split_formatted_text,
+)
 
 
 def test_format_message_wraps_html_without_backticks():
@@ -45,3 +54,59 @@ def test_split_long_code_block_preserves_fences():
     total = "".join(part.replace("```html\n", "").replace("```", "") for part in parts)
     assert "<div id='0'></div>" in total
 
+
+def test_prepare_for_edit_matches_two_pass_formatting_for_prose():
+    raw = "## Итог\nЭто **важно** и _тонко_, см. `a_b` (v1.2)!"
+    assert prepare_for_edit(raw) == "Итог\nЭто важно и тонко, см\\. `a_b` \\(v1\\.2\\)\\!"
+
+    for sample in (
+        raw,
+        "***x***",
+        "**_жирный_** и _a *b* c_",
+        "Пример ниже.\nHTML:\nи **текст**",
+    ):
+        assert prepare_for_edit(sample) == format_message(remove_markdown_stars(sample))
+
+
+def test_prepare_for_edit_does_not_wrap_code_like_previews():
+    raw = "def foo(x):\n    return x + 1"
+    assert format_message(raw).startswith("```python\n")
+    assert prepare_for_edit(raw) == escape_markdown_v2(raw)
+
+
+def test_prepare_for_edit_escapes_unmatched_markers():
+    assert prepare_for_edit("2*3 = 6_") == escape_markdown_v2("2*3 = 6_")
+
+
+def test_format_message_strips_headings_and_labels_outside_code():
+    raw = "## Пример\nPython:\nКод:\n```python\n# comment\nprint(1)\n```"
+    formatted = format_message(raw)
+
+    assert formatted.startswith("Пример\nPython:\n\n```python\n# comment\n")
+
+
+def test_remove_markdown_stars_keeps_code_blocks_intact():
+    raw = "**Жирный** и _курсив_\n```python\nx = a_b * c_d\n```\n__конец__"
+    assert remove_markdown_stars(raw) == "Жирный и курсив\n```python\nx = a_b * c_d\n```\nконец"
+
+
+def test_detect_code_language_keeps_pattern_priority():
+    # The CSS rule comes first in the text, but HTML has the higher priority.
+    assert detect_code_language("p { color: red }\n<div>text</div>") == (True, "html")
+
+
+def test_remove_markdown_stars_strips_nested_emphasis():
+    assert remove_markdown_stars("***x***") == "x"
+    assert remove_markdown_stars("**_жирный_**") == "жирный"
+    assert remove_markdown_stars("_a *b* c_") == "a b c"
+
+    started = time.perf_counter()
+    prepare_for_edit("*" * 1500 + "x" + "*" * 1500)
+    assert time.perf_counter() - started < 0.1
+
+
+def test_label_stripping_stays_linear_on_blank_line_runs():
+    started = time.perf_counter()
+    prepare_for_edit(" \n" * 1500)
+    format_message("Итог:\n" + "\n" * 8000 + "x")
+    assert time.perf_counter() - started < 0.5
@@ -0,0 +1,31 @@
+import os
+from types import SimpleNamespace
+
+from src import handlers
+
+
+def test_load_conference_info_rereads_changed_file(tmp_path, monkeypatch):
+    info_path = tmp_path / "info.md"
+    monkeypatch.setattr(handlers, "CONFERENCE_INFO_PATH", info_path)
+    assert handlers.load_conference_info() is None
+
+    info_path.write_text("v1", encoding="utf-8")
+    assert handlers.load_conference_info() == "v1"
+    assert handlers.get_conference_context().endswith("\n\nv1")
+
+    info_path.write_text("v2", encoding="utf-8")
+    stat = info_path.stat()
+    os.utime(info_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert handlers.load_conference_info() == "v2"
+
+
+def test_get_user_info_reflects_changed_fields():
+    user = SimpleNamespace(
+        first_name="Ann", last_name=None, username="ann", id=7, language_code="ru"
+    )
+    assert handlers.get_user_info(user) == (
+        "Информация о пользователе:\nИмя: Ann\nUsername: @ann\nID: 7\nЯзык: ru"
+    )
+
+    user.username = "ann_k"
+    assert "Username: @ann_k" in handlers.get_user_info(user)
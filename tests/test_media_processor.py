@@ -0,0 +1,28 @@
+import base64
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src import media_processor
+from src.media_processor import get_audio_base64
+
+
+@pytest.mark.asyncio
+async def test_get_audio_base64_encodes_downloaded_bytes():
+    payload = bytes(range(256)) * 3
+    file = MagicMock()
+    file.download_as_bytearray = AsyncMock(return_value=bytearray(payload))
+    audio = MagicMock()
+    audio.get_file = AsyncMock(return_value=file)
+
+    assert await get_audio_base64(audio) == base64.b64encode(payload).decode()
+    file.download_as_bytearray.assert_awaited_once()
+
+
+def test_encode_base64_joins_chunks_across_slice_boundaries(monkeypatch):
+    monkeypatch.setattr(media_processor, "MEDIA_ENCODE_CHUNK_SIZE", 3 * 5)
+    payload = bytes(range(256)) * 3 + b"xy"
+    data = bytearray(payload)
+
+    assert media_processor._encode_base64(data) == base64.b64encode(payload).decode()
+    assert not data
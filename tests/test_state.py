@@ -1,19 +1,72 @@
-from src.state import ContextStore
+import asyncio
+
+import pytest
+
+from src.state import ContextStore, DialogueState
 from src.storage import DialogueStorage
 
 
-def test_context_store_loads_from_storage(tmp_path):
+@pytest.mark.asyncio
+async def test_context_store_loads_from_storage(tmp_path):
     storage = DialogueStorage(tmp_path / "dialogues.db")
     store = ContextStore(max_messages=3, storage=storage)
-    store.append(1, "user", "a")
-    store.append(1, "assistant", "b")
+    await store.append(1, "user", "a")
+    await store.append(1, "assistant", "b")
+    await store.flush()
 
     store = ContextStore(max_messages=3, storage=storage)
-    state = store.get(1)
+    state = await store.get(1)
     assert [msg["content"] for msg in state.export()] == ["a", "b"]
 
-    store.append(1, "user", "c")
-    store.append(1, "assistant", "d")
-    state = store.get(1)
+    await store.append(1, "user", "c")
+    await store.append(1, "assistant", "d")
+    state = await store.get(1)
     assert len(state.export()) == 3
 
+
+@pytest.mark.asyncio
+async def test_context_store_batches_writes(tmp_path):
+    storage = DialogueStorage(tmp_path / "dialogues.db")
+    store = ContextStore(max_messages=3, storage=storage, flush_batch_size=3)
+    await store.append(1, "user", "a")
+    await store.append(1, "assistant", "b")
+    assert storage.load_history(1, limit=3) == []
+
+    await store.append(2, "user", "c")
+    assert [msg["content"] for msg in storage.load_history(1, limit=3)] == ["a", "b"]
+    assert [msg["content"] for msg in storage.load_history(2, limit=3)] == ["c"]
+
+    await store.append(2, "assistant", "d")
+    await store.reset(2)
+    await store.flush()
+    assert storage.load_history(2, limit=3) == []
+
+
+def test_dialogue_state_keeps_latest_messages_in_order():
+    state = DialogueState(user_id=1, max_messages=3)
+    assert [state.append("user", str(idx)) for idx in range(5)] == [False, False, False, True, True]
+    assert [msg["content"] for msg in state.export()] == ["2", "3", "4"]
+
+    state.reset()
+    state.append("user", "x")
+    assert state.export() == [{"role": "user", "content": "x"}]
+
+
+@pytest.mark.asyncio
+async def test_context_store_keeps_appends_made_during_reset(tmp_path):
+    storage = DialogueStorage(tmp_path / "dialogues.db")
+    store = ContextStore(max_messages=3, storage=storage, flush_batch_size=1)
+    await store.append(1, "user", "old")
+
+    await store._write_lock.acquire()
+    reset_task = asyncio.create_task(store.reset(1))
+    await asyncio.sleep(0)
+    append_task = asyncio.create_task(store.append(1, "user", "new"))
+    await asyncio.sleep(0)
+    store._write_lock.release()
+    await reset_task
+    await append_task
+    await store.flush()
+
+    assert [msg["content"] for msg in (await store.get(1)).export()] == ["new"]
+    assert [msg["content"] for msg in storage.load_history(1, limit=3)] == ["new"]
@@ -1,3 +1,7 @@
+import sqlite3
+
+import pytest
+
 from src.storage import DialogueStorage
 
 
@@ -21,3 +25,44 @@ def test_dialogue_storage_persists_history(tmp_path):
     storage.reset_user(123)
     assert storage.load_history(123, limit=5) == []
 
+
+def test_dialogue_storage_trim_keeps_latest(tmp_path):
+    storage = DialogueStorage(tmp_path / "dialogues.db")
+    storage.append_many([(1, "user", text) for text in "abcde"] + [(2, "user", "x")])
+
+    storage.trim(1, keep=2)
+    assert [msg["content"] for msg in storage.load_history(1, limit=10)] == ["d", "e"]
+    assert [msg["content"] for msg in storage.load_history(2, limit=10)] == ["x"]
+
+    storage.trim(2, keep=2)
+    assert [msg["content"] for msg in storage.load_history(2, limit=10)] == ["x"]
+
+
+def test_dialogue_storage_migrates_legacy_rows(tmp_path):
+    db_path = tmp_path / "dialogues.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE dialogue_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "user_id INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO dialogue_messages (user_id, role, content) VALUES (?, ?, ?)",
+            [(1, "user", "42"), (1, "user", '[{"type": "text", "text": "hi"}]')],
+        )
+    conn.close()
+
+    storage = DialogueStorage(db_path)
+    assert storage.load_history(1, limit=5) == [
+        {"role": "user", "content": "42"},
+        {"role": "user", "content": [{"type": "text", "text": "hi"}]},
+    ]
+
+
+def test_dialogue_storage_rolls_back_failed_replace(tmp_path):
+    storage = DialogueStorage(tmp_path / "dialogues.db")
+    storage.append(1, "user", "keep")
+
+    with pytest.raises(sqlite3.Error):
+        storage.replace_history(1, [{"role": object(), "content": "new"}])
+
+    assert storage.load_history(1, limit=5) == [{"role": "user", "content": "keep"}]
@@ -0,0 +1,27 @@
+import httpx
+import pytest
+import respx
+
+from src import web_search
+
+
+@pytest.mark.asyncio
+async def test_search_web_reuses_client(monkeypatch):
+    monkeypatch.setenv("EXA_API_KEY", "test-key")
+    results = {"results": [{"title": "T", "url": "https://example.com", "text": "body"}]}
+
+    with respx.mock:
+        route = respx.post("https://api.exa.ai/search").mock(
+            return_value=httpx.Response(200, json=results)
+        )
+        first = await web_search.search_web("q")
+        client = web_search._exa_client
+        second = await web_search.search_web("q")
+
+    assert first == second == "1. T\nURL: https://example.com\nbody"
+    assert route.call_count == 2
+    assert route.calls[0].request.headers["x-api-key"] == "test-key"
+    assert web_search._exa_client is client
+
+    await web_search.close_search_client()
+    assert web_search._exa_client is None